@@ -2,6 +2,9 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import plotly.express as px
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pyarrow import csv as pacsv
 
 import io
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
@@ -10,34 +13,169 @@ from reportlab.lib.units import inch
 
 st.set_page_config(page_title="제조기업 경영진단", layout="wide")
 st.title("🏭 제조기업 경영진단 (실전 버전)")
-st.caption("엑셀/CSV 업로드 → 컬럼 매핑 → KPI 산출 → 점수/리스크 신호등 → 개선 포인트 제시")
-
-uploaded = st.file_uploader("📤 생산/재무/품질 데이터(엑셀 또는 CSV) 업로드", type=["xlsx", "csv"])
-
-def load_df(file):
-    if file.name.lower().endswith(".csv"):
-        return pd.read_csv(file)
-    return pd.read_excel(file)
+st.caption("엑셀/CSV/Parquet 업로드 → 컬럼 매핑 → KPI 산출 → 점수/리스크 신호등 → 개선 포인트 제시")
+
+uploaded = st.file_uploader("📤 생산/재무/품질 데이터(엑셀, CSV 또는 Parquet) 업로드", type=["xlsx", "csv", "parquet"])
+
+@st.cache_data(show_spinner="데이터 불러오는 중…", max_entries=4)
+def load_df(file_bytes, name, columns=None):
+    # UploadedFile 대신 bytes+파일명을 받아야 캐시 키로 해시됨 → 위젯 조작(rerun)마다 재파싱하지 않음
+    if name.lower().endswith(".parquet"):
+        # 파서 없이 컬럼 단위로 읽음. columns 지정 시 해당 컬럼만 읽음(projection pushdown)
+        return pd.read_parquet(io.BytesIO(file_bytes), engine="pyarrow",
+                               columns=None if columns is None else list(columns))
+    if name.lower().endswith(".csv"):
+        # Arrow C++ 멀티스레드 CSV 파서 (pandas 파서 대비 수 배 빠름)
+        try:
+            # strings_can_be_null: 문자 컬럼의 빈칸/NA/N/A도 pandas처럼 결측으로 읽음
+            tbl = pacsv.read_csv(io.BytesIO(file_bytes),
+                                 read_options=pacsv.ReadOptions(use_threads=True, block_size=8 << 20),
+                                 convert_options=pacsv.ConvertOptions(strings_can_be_null=True))
+        except pa.ArrowInvalid:
+            # 행마다 컬럼 수가 다른 등 Arrow가 거부하는 파일은 기존 pandas 파서로 읽음
+            return pd.read_csv(io.BytesIO(file_bytes))
+        return tbl.rename_columns(dedup_columns(tbl.column_names)).to_pandas()
+    return read_xlsx(file_bytes)
+
+def dedup_columns(names):
+    # pd.read_csv와 같은 방식으로 빈 컬럼명은 Unnamed: i, 중복 컬럼명은 x, x.1, x.2 … 로 바꿈 (이미 있는 이름은 건너뜀)
+    # pandas처럼 이름이 있는 컬럼을 먼저 정리하고, 빈 컬럼명에서 만든 Unnamed: i는 나중에 중복 처리
+    existing = set(names)
+    counts = {}
+    out = list(names)
+    def unique(col):
+        if col not in counts:
+            counts[col] = 1
+            existing.add(col)
+            return col
+        k = counts[col]
+        while f"{col}.{k}" in existing:
+            k += 1
+        counts[col] = k + 1
+        existing.add(f"{col}.{k}")
+        return f"{col}.{k}"
+    for i, col in enumerate(names):
+        if col:
+            out[i] = unique(col)
+    for i, col in enumerate(names):
+        if not col:
+            out[i] = unique(f"Unnamed: {i}")
+    return out
+
+def read_xlsx(file_bytes):
+    # calamine(Rust) 엔진: openpyxl(순수 파이썬) 대비 엑셀 파싱이 훨씬 빠름
+    # 통합문서는 한 번만 열고 모든 시트를 한 번에 읽음
+    sheets = list(pd.read_excel(io.BytesIO(file_bytes), sheet_name=None, engine="calamine").values())
+    if len(sheets) <= 1:
+        return sheets[0]
+    # 첫 시트와 컬럼 구성이 같은 시트(월별 시트 등)만 이어 붙임. 형식이 다른 시트는 기존처럼 무시
+    return pd.concat([f for f in sheets if f.columns.equals(sheets[0].columns)], ignore_index=True)
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def load_preview(file_bytes, name, n=50):
+    # 미리보기/컬럼 목록용 앞 n행. 파일당 한 번만 만들어 rerun마다 head()/변환을 반복하지 않음
+    if not name.lower().endswith(".parquet"):
+        return load_df(file_bytes, name).head(n)
+    # Parquet는 전체를 읽지 않고 앞 n행만 읽음
+    pf = pq.ParquetFile(io.BytesIO(file_bytes))
+    batch = next(pf.iter_batches(batch_size=n), None)
+    if batch is None:
+        return pf.schema_arrow.empty_table().to_pandas()
+    return pa.Table.from_batches([batch]).to_pandas()
+
+@st.cache_data(show_spinner="Parquet 변환 중…", max_entries=4)
+def to_parquet_bytes(file_bytes, name):
+    # 엑셀/CSV → Parquet 변환. 사용자가 요청할 때만 실행하고, 세션 중 반복 요청은 메모리 캐시로 처리
+    buf = io.BytesIO()
+    load_df(file_bytes, name).to_parquet(buf, engine="pyarrow", index=False)
+    return buf.getvalue()
 
 def to_num(s):
+    # xlsx/parquet처럼 이미 숫자 타입이면 변환 스캔을 건너뜀
+    if pd.api.types.is_numeric_dtype(s):
+        return s
     return pd.to_numeric(s, errors="coerce")
 
-def safe_sum(df, col):
-    if col == "(없음)":
-        return None
-    return float(to_num(df[col]).fillna(0).sum())
+@st.cache_data(show_spinner=False, max_entries=4)
+def numeric_frame(df, cols):
+    # 매핑된 숫자 컬럼을 한 번에 변환. KPI/그래프/분해 분석이 모두 이 결과를 공유함
+    cols = [c for c in dict.fromkeys(cols) if c != "(없음)"]
+    return df[cols].apply(to_num)
 
-def safe_mean(df, col):
+def safe_sum(sums, col):
     if col == "(없음)":
         return None
-    x = to_num(df[col]).dropna()
-    return None if x.empty else float(x.mean())
+    return float(sums[col])
+
+def breakdown_sum(df, num, keys, values):
+    # keys/values: {표시이름: 원본컬럼}. 키는 df, 값은 이미 숫자로 변환된 num에서 가져옴
+    # 모든 분해 키 조합으로 한 번만 합계 → 키별 집계는 이 작은 결과에서 marginal_sum으로 다시 합산
+    # 결과를 지표 기준으로 다시 정렬하므로 키 정렬(sort)은 생략
+    tmp = pd.DataFrame({name: num[col] for name, col in values.items()})
+    by = [df[col].rename(name) for name, col in keys.items()]
+    return tmp.groupby(by, sort=False, dropna=False).sum()
+
+def marginal_sum(agg, key):
+    # 다른 키가 비어 있던 행도 포함되도록 breakdown_sum은 dropna=False, 여기서 해당 키의 빈 값만 제외
+    return agg.groupby(level=key, sort=False).sum().reset_index()
+
+def row_ratio(n, d):
+    # n / d를 나눗셈 한 번으로 계산. d <= 0 이거나 비어 있으면 NaN (np.where처럼 중간 배열을 만들지 않음)
+    n = np.asarray(n, dtype=np.float64)
+    d = np.asarray(d, dtype=np.float64)
+    return np.divide(n, d, out=np.full(n.shape, np.nan), where=d > 0)
+
+def to_dt(s, fmt):
+    # 형식을 지정하면 행마다 형식을 추측하지 않는 고속 경로로 파싱, cache=True로 같은 날짜 문자열은 한 번만 변환
+    # 형식이 잘못됐거나(예: %Q) 하나도 읽히지 않으면 형식 없이(자동 인식) 다시 파싱
+    if fmt:
+        try:
+            out = pd.to_datetime(s, format=fmt, errors="coerce", cache=True)
+        except ValueError:
+            out = None
+        if out is not None and out.notna().any():
+            return out
+    return pd.to_datetime(s, errors="coerce", cache=True)
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def parse_dates(df, col_due, col_ship, fmt):
+    # 납기일/출고일을 datetime64 배열로 한 번만 변환 (납기 준수율과 탭3 히스토그램이 같은 캐시를 사용)
+    if col_due == "(없음)" or col_ship == "(없음)":
+        return None, None
+    return dt_array(to_dt(df[col_due], fmt)), dt_array(to_dt(df[col_ship], fmt))
+
+def dt_array(s):
+    # 시간대는 UTC 기준으로 떼고 us 단위 numpy 배열로 변환
+    # (ns로 캐스팅하면 9999-12-31 같은 자리표시 날짜가 범위를 넘어 엉뚱한 날짜로 바뀜)
+    if s.dt.tz is not None:
+        s = s.dt.tz_convert(None)
+    return s.dt.as_unit("us").to_numpy()
+
+def on_time_ratio(due, ship):
+    # 납기 준수율(간이): 출고일 <= 납기일 (두 날짜가 모두 있는 행만)
+    if due is None:
+        return None
+    valid = ~(np.isnat(due) | np.isnat(ship))
+    n = np.count_nonzero(valid)
+    if n == 0:
+        return None
+    return float(np.count_nonzero(ship[valid] <= due[valid]) / n)
 
 def safe_ratio(n, d):
     if n is None or d in [None, 0]:
         return None
     return n / d
 
+def score_vec(values, good, warn, inverse=False):
+    """
+    score_by_threshold / score_by_inverse_threshold의 벡터 버전(품목별 점수 등):
+      - 배열 전체를 분기 없이 한 번에 100/70/40으로 변환, int8로 반환
+      - NaN은 40이 되므로 호출하는 쪽에서 미리 걸러야 함
+    """
+    v = np.asarray(values, dtype=np.float64)
+    good_mask, warn_mask = (v <= good, v <= warn) if inverse else (v >= good, v >= warn)
+    return np.select([good_mask, warn_mask], [100, 70], default=40).astype(np.int8)
+
 def score_by_threshold(value, good, warn):
     """
     value가 높을수록 좋은 지표(예: 이익률):
@@ -47,11 +185,7 @@ def score_by_threshold(value, good, warn):
     """
     if value is None:
         return None
-    if value >= good:
-        return 100
-    if value >= warn:
-        return 70
-    return 40
+    return int(score_vec([value], good, warn)[0])
 
 def score_by_inverse_threshold(value, good, warn):
     """
@@ -62,11 +196,27 @@ def score_by_inverse_threshold(value, good, warn):
     """
     if value is None:
         return None
-    if value <= good:
-        return 100
-    if value <= warn:
-        return 70
-    return 40
+    return int(score_vec([value], good, warn, inverse=True)[0])
+
+@st.cache_resource(show_spinner=False, max_entries=32)
+def cached_figure(kind, data, **kwargs):
+    # 같은 데이터/옵션이면 rerun마다 plotly Figure를 다시 만들지 않고 재사용 (st.plotly_chart는 Figure를 수정하지 않음)
+    return getattr(px, kind)(data, **kwargs)
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def hist_figure(values, label, title, nbins=30, integer=False):
+    # 구간별 개수를 서버에서 미리 세어 막대로 그림 → 브라우저로 보내는 데이터가 행 수와 무관하게 nbins개
+    # integer=True(일수 등 정수 값)면 구간 경계를 정수 사이(±0.5)에 둬서 막대가 정수 위에 오도록 함
+    bins = nbins
+    if integer:
+        lo, hi = int(values.min()), int(values.max())
+        width = max(1, -(-(hi - lo + 1) // nbins))
+        bins = np.arange(lo, hi + width + 1, width) - 0.5
+    counts, edges = np.histogram(values, bins=bins)
+    tmp = pd.DataFrame({label: 0.5 * (edges[:-1] + edges[1:]), "count": counts})
+    fig = px.bar(tmp, x=label, y="count", title=title)
+    fig.update_layout(bargap=0)
+    return fig
 
 def traffic_light(score):
     if score is None:
@@ -77,121 +227,7 @@ def traffic_light(score):
         return "🟠"
     return "🔴"
 
-if not uploaded:
-    st.info("업로드 후 시작됩니다. (권장 컬럼 예: 매출, 매출원가, 고정비, 인건비, 생산수량, 양품수량, 불량수량, 납기일, 출고일, 재고수량 등)")
-    st.stop()
-
-df = load_df(uploaded)
-st.subheader("1) 데이터 미리보기")
-st.dataframe(df.head(50), use_container_width=True)
-
-cols = df.columns.tolist()
-
-st.subheader("2) 컬럼 매핑 (파일마다 이름이 달라도 선택하면 됩니다)")
-c1, c2, c3, c4, c5 = st.columns(5)
-with c1:
-    col_date = st.selectbox("기준일(선택)", ["(없음)"] + cols)
-with c2:
-    col_sales = st.selectbox("매출", ["(없음)"] + cols)
-with c3:
-    col_cogs = st.selectbox("매출원가", ["(없음)"] + cols)
-with c4:
-    col_fixed = st.selectbox("고정비", ["(없음)"] + cols)
-with c5:
-    col_labor = st.selectbox("인건비", ["(없음)"] + cols)
-
-c6, c7, c8, c9, c10 = st.columns(5)
-with c6:
-    col_prod_qty = st.selectbox("생산수량", ["(없음)"] + cols)
-with c7:
-    col_good_qty = st.selectbox("양품수량", ["(없음)"] + cols)
-with c8:
-    col_defect_qty = st.selectbox("불량수량", ["(없음)"] + cols)
-with c9:
-    col_due = st.selectbox("납기일(선택)", ["(없음)"] + cols)
-with c10:
-    col_ship = st.selectbox("출고/완료일(선택)", ["(없음)"] + cols)
-
-c11, c12, c13, c14, c15 = st.columns(5)
-with c11:
-    col_inventory = st.selectbox("재고수량(선택)", ["(없음)"] + cols)
-with c12:
-    col_unit_cost = st.selectbox("단위원가(선택)", ["(없음)"] + cols)
-with c13:
-    col_unit_price = st.selectbox("단가(선택)", ["(없음)"] + cols)
-with c14:
-    col_overtime = st.selectbox("연장근로시간(선택)", ["(없음)"] + cols)
-with c15:
-    col_downtime = st.selectbox("비가동시간(선택)", ["(없음)"] + cols)
-
-st.divider()
-
-# ---- KPI 계산 ----
-sales = safe_sum(df, col_sales)
-cogs = safe_sum(df, col_cogs)
-fixed = safe_sum(df, col_fixed)
-labor = safe_sum(df, col_labor)
-
-gross = None if (sales is None or cogs is None) else (sales - cogs)
-gross_margin = safe_ratio(gross, sales)
-
-op_profit = None
-if sales is not None:
-    op_profit = sales
-    if cogs is not None: op_profit -= cogs
-    if fixed is not None: op_profit -= fixed
-    if labor is not None: op_profit -= labor
-
-op_margin = safe_ratio(op_profit, sales)
-
-prod_qty = safe_sum(df, col_prod_qty)
-good_qty = safe_sum(df, col_good_qty)
-defect_qty = safe_sum(df, col_defect_qty)
-
-# 불량률 = 불량 / 생산
-defect_rate = safe_ratio(defect_qty, prod_qty)
-
-# 수율 = 양품 / 생산
-yield_rate = safe_ratio(good_qty, prod_qty)
-
-# 납기 준수율(간이): 출고일 <= 납기일
-on_time_rate = None
-if col_due != "(없음)" and col_ship != "(없음)":
-    due = pd.to_datetime(df[col_due], errors="coerce")
-    ship = pd.to_datetime(df[col_ship], errors="coerce")
-    valid = due.notna() & ship.notna()
-    if valid.any():
-        on_time_rate = float((ship[valid] <= due[valid]).mean())
-
-# 재고금액(간이): 재고수량 * 단위원가
-inventory_value = None
-if col_inventory != "(없음)" and col_unit_cost != "(없음)":
-    inv = to_num(df[col_inventory]).fillna(0)
-    uc = to_num(df[col_unit_cost]).fillna(0)
-    inventory_value = float((inv * uc).sum())
-
-# ---- 점수화(룰 기반) ----
-# 대표님 현장용 기본 기준치(업종별로 조정 가능)
-score_gm = score_by_threshold(gross_margin, good=0.25, warn=0.15)          # 총이익률 25%↑ 좋음, 15% 미만 위험
-score_om = score_by_threshold(op_margin, good=0.10, warn=0.05)             # 영업이익률 10%↑ 좋음, 5% 미만 위험
-score_def = score_by_inverse_threshold(defect_rate, good=0.01, warn=0.03)  # 불량률 1% 이하 좋음, 3% 초과 위험
-score_yield = score_by_threshold(yield_rate, good=0.98, warn=0.95)         # 수율 98%↑ 좋음, 95% 미만 위험
-score_otd = score_by_threshold(on_time_rate, good=0.95, warn=0.90)         # 납기 95%↑ 좋음, 90% 미만 위험
-
-# 재고는 업종편차 커서 "재고금액/매출"로 간이 판단 (데이터 있으면)
-inv_to_sales = safe_ratio(inventory_value, sales)
-score_inv = score_by_inverse_threshold(inv_to_sales, good=0.15, warn=0.30) if inv_to_sales is not None else None
-
-# 총점(가중치)
-scores = {
-    "수익성(총이익률)": score_gm,
-    "수익성(영업이익률)": score_om,
-    "품질(불량률)": score_def,
-    "품질(수율)": score_yield,
-    "납기(준수율)": score_otd,
-    "재고(재고/매출)": score_inv
-}
-
+# 종합점수 가중치
 weights = {
     "수익성(총이익률)": 0.22,
     "수익성(영업이익률)": 0.22,
@@ -201,10 +237,225 @@ weights = {
     "재고(재고/매출)": 0.08
 }
 
-weighted_items = [(k, v, weights[k]) for k, v in scores.items() if v is not None]
-total_score = None
-if weighted_items:
-    total_score = float(sum(v*w for _, v, w in weighted_items) / sum(w for _, _, w in weighted_items))
+@st.cache_data(show_spinner=False)
+def compute_kpis(num, on_time_rate, mapping):
+    # KPI 스칼라 + 점수를 한 번에 계산. 입력이 같으면 탭 전환/버튼 클릭 rerun에서 통째로 건너뜀
+    mapping = dict(mapping)
+    sums = num.sum()
+
+    sales = safe_sum(sums, mapping["sales"])
+    cogs = safe_sum(sums, mapping["cogs"])
+    fixed = safe_sum(sums, mapping["fixed"])
+    labor = safe_sum(sums, mapping["labor"])
+
+    gross = None if (sales is None or cogs is None) else (sales - cogs)
+    gross_margin = safe_ratio(gross, sales)
+
+    op_profit = None
+    if sales is not None:
+        op_profit = sales
+        if cogs is not None: op_profit -= cogs
+        if fixed is not None: op_profit -= fixed
+        if labor is not None: op_profit -= labor
+
+    op_margin = safe_ratio(op_profit, sales)
+
+    prod_qty = safe_sum(sums, mapping["prod_qty"])
+    good_qty = safe_sum(sums, mapping["good_qty"])
+    defect_qty = safe_sum(sums, mapping["defect_qty"])
+
+    # 불량률 = 불량 / 생산
+    defect_rate = safe_ratio(defect_qty, prod_qty)
+
+    # 수율 = 양품 / 생산
+    yield_rate = safe_ratio(good_qty, prod_qty)
+
+    # 재고금액(간이): 재고수량 * 단위원가 (둘 중 하나라도 비면 0 취급 → 해당 행 제외 후 내적 한 번)
+    inventory_value = None
+    if mapping["inventory"] != "(없음)" and mapping["unit_cost"] != "(없음)":
+        inv = num[mapping["inventory"]].to_numpy(dtype=np.float64)
+        uc = num[mapping["unit_cost"]].to_numpy(dtype=np.float64)
+        m = ~(np.isnan(inv) | np.isnan(uc))
+        inventory_value = float(np.dot(inv[m], uc[m]))
+
+    # ---- 점수화(룰 기반) ----
+    # 대표님 현장용 기본 기준치(업종별로 조정 가능)
+    score_gm = score_by_threshold(gross_margin, good=0.25, warn=0.15)          # 총이익률 25%↑ 좋음, 15% 미만 위험
+    score_om = score_by_threshold(op_margin, good=0.10, warn=0.05)             # 영업이익률 10%↑ 좋음, 5% 미만 위험
+    score_def = score_by_inverse_threshold(defect_rate, good=0.01, warn=0.03)  # 불량률 1% 이하 좋음, 3% 초과 위험
+    score_yield = score_by_threshold(yield_rate, good=0.98, warn=0.95)         # 수율 98%↑ 좋음, 95% 미만 위험
+    score_otd = score_by_threshold(on_time_rate, good=0.95, warn=0.90)         # 납기 95%↑ 좋음, 90% 미만 위험
+
+    # 재고는 업종편차 커서 "재고금액/매출"로 간이 판단 (데이터 있으면)
+    inv_to_sales = safe_ratio(inventory_value, sales)
+    score_inv = score_by_inverse_threshold(inv_to_sales, good=0.15, warn=0.30) if inv_to_sales is not None else None
+
+    # 총점(가중치)
+    scores = {
+        "수익성(총이익률)": score_gm,
+        "수익성(영업이익률)": score_om,
+        "품질(불량률)": score_def,
+        "품질(수율)": score_yield,
+        "납기(준수율)": score_otd,
+        "재고(재고/매출)": score_inv
+    }
+
+    # 점수가 있는 항목만 가중평균 (없는 항목은 NaN → 마스크로 제외)
+    s = np.array([np.nan if v is None else v for v in scores.values()], dtype=np.float64)
+    w = np.array([weights[k] for k in scores], dtype=np.float64)
+    m = ~np.isnan(s)
+    total_score = float(np.dot(s[m], w[m]) / w[m].sum()) if m.any() else None
+
+    return {
+        "sales": sales,
+        "gross_margin": gross_margin,
+        "op_margin": op_margin,
+        "defect_rate": defect_rate,
+        "yield_rate": yield_rate,
+        "on_time_rate": on_time_rate,
+        "inv_to_sales": inv_to_sales,
+        "scores": scores,
+        "total_score": total_score,
+    }
+
+if not uploaded:
+    st.info("업로드 후 시작됩니다. (권장 컬럼 예: 매출, 매출원가, 고정비, 인건비, 생산수량, 양품수량, 불량수량, 납기일, 출고일, 재고수량 등)")
+    st.stop()
+
+file_bytes = uploaded.getvalue()
+is_parquet = uploaded.name.lower().endswith(".parquet")
+preview = load_preview(file_bytes, uploaded.name)
+if not is_parquet:
+    # Parquet는 매핑된 컬럼만 나중에 읽음
+    df = load_df(file_bytes, uploaded.name)
+
+st.subheader("1) 데이터 미리보기")
+st.dataframe(preview, use_container_width=True)
+
+if not is_parquet and st.button("Parquet로 변환 (다음 업로드부터 파싱 생략)"):
+    try:
+        parquet_bytes = to_parquet_bytes(file_bytes, uploaded.name)
+    except (TypeError, ValueError):
+        # 한 컬럼에 숫자/문자가 섞여 있으면 Parquet로 변환할 수 없음
+        parquet_bytes = None
+    if parquet_bytes is None:
+        st.warning("숫자/문자가 섞인 컬럼이 있어 Parquet로 변환할 수 없습니다.")
+    else:
+        st.download_button(
+            label="⬇ Parquet 다운로드",
+            data=parquet_bytes,
+            file_name=uploaded.name.rsplit(".", 1)[0] + ".parquet",
+            mime="application/octet-stream"
+        )
+
+cols = preview.columns.tolist()
+
+st.subheader("2) 컬럼 매핑 (파일마다 이름이 달라도 선택 후 '적용'을 누르면 됩니다)")
+# 선택지는 한 번만 만들고, 매핑은 폼으로 묶어 "적용"을 누를 때만 rerun/KPI 계산이 일어나게 함
+options = ("(없음)", *cols)
+with st.form("mapping"):
+    c1, c2, c3, c4, c5 = st.columns(5)
+    with c1:
+        col_date = st.selectbox("기준일(선택)", options)
+    with c2:
+        col_sales = st.selectbox("매출", options)
+    with c3:
+        col_cogs = st.selectbox("매출원가", options)
+    with c4:
+        col_fixed = st.selectbox("고정비", options)
+    with c5:
+        col_labor = st.selectbox("인건비", options)
+
+    c6, c7, c8, c9, c10 = st.columns(5)
+    with c6:
+        col_prod_qty = st.selectbox("생산수량", options)
+    with c7:
+        col_good_qty = st.selectbox("양품수량", options)
+    with c8:
+        col_defect_qty = st.selectbox("불량수량", options)
+    with c9:
+        col_due = st.selectbox("납기일(선택)", options)
+    with c10:
+        col_ship = st.selectbox("출고/완료일(선택)", options)
+
+    c11, c12, c13, c14, c15 = st.columns(5)
+    with c11:
+        col_inventory = st.selectbox("재고수량(선택)", options)
+    with c12:
+        col_unit_cost = st.selectbox("단위원가(선택)", options)
+    with c13:
+        col_unit_price = st.selectbox("단가(선택)", options)
+    with c14:
+        col_overtime = st.selectbox("연장근로시간(선택)", options)
+    with c15:
+        col_downtime = st.selectbox("비가동시간(선택)", options)
+
+    c16, c17, c18, c19, c20 = st.columns(5)
+    with c16:
+        col_item = st.selectbox("품목(선택)", options)
+    with c17:
+        col_line = st.selectbox("라인(선택)", options)
+    with c18:
+        col_process = st.selectbox("공정(선택)", options)
+    with c19:
+        col_defect_reason = st.selectbox("불량사유(선택)", options)
+    with c20:
+        date_fmt = st.text_input("날짜 형식(선택)", "%Y-%m-%d",
+                                 help="납기일/출고일 형식. 비우거나 맞지 않으면 자동 인식(느림)으로 처리합니다.")
+
+    st.form_submit_button("적용")
+
+# 이후 계산은 매핑된 컬럼만 사용 → 한 번만 좁혀 두면 캐시 해시/슬라이스/groupby가 모두 가벼워짐
+used = [c for c in dict.fromkeys([
+    col_date, col_sales, col_cogs, col_fixed, col_labor,
+    col_prod_qty, col_good_qty, col_defect_qty, col_due, col_ship,
+    col_inventory, col_unit_cost, col_unit_price, col_overtime, col_downtime,
+    col_item, col_line, col_process, col_defect_reason
+]) if c != "(없음)"]
+if is_parquet:
+    # Parquet는 매핑된 컬럼만 파일에서 읽음(projection pushdown)
+    df = load_df(file_bytes, uploaded.name, tuple(used))
+else:
+    df = df[used]
+
+st.divider()
+
+# ---- KPI 계산 ----
+# 숫자 컬럼과 날짜 컬럼은 페이지 전체에서 한 번씩만 변환 → KPI/그래프/분해 분석이 같은 결과를 사용
+num = numeric_frame(df, (
+    col_sales, col_cogs, col_fixed, col_labor, col_prod_qty, col_good_qty, col_defect_qty,
+    col_inventory, col_unit_cost, col_unit_price
+))
+due, ship = parse_dates(df, col_due, col_ship, date_fmt)
+
+# 매핑은 정렬된 (역할, 컬럼) 튜플로 넘겨 캐시 키 해시를 가볍게 유지
+kpi = compute_kpis(num, on_time_ratio(due, ship), tuple(sorted({
+    "sales": col_sales,
+    "cogs": col_cogs,
+    "fixed": col_fixed,
+    "labor": col_labor,
+    "prod_qty": col_prod_qty,
+    "good_qty": col_good_qty,
+    "defect_qty": col_defect_qty,
+    "inventory": col_inventory,
+    "unit_cost": col_unit_cost,
+}.items())))
+sales = kpi["sales"]
+gross_margin = kpi["gross_margin"]
+op_margin = kpi["op_margin"]
+defect_rate = kpi["defect_rate"]
+yield_rate = kpi["yield_rate"]
+on_time_rate = kpi["on_time_rate"]
+inv_to_sales = kpi["inv_to_sales"]
+scores = kpi["scores"]
+total_score = kpi["total_score"]
+
+score_gm = scores["수익성(총이익률)"]
+score_om = scores["수익성(영업이익률)"]
+score_def = scores["품질(불량률)"]
+score_yield = scores["품질(수율)"]
+score_otd = scores["납기(준수율)"]
+score_inv = scores["재고(재고/매출)"]
 
 st.subheader("3) KPI 요약")
 k1, k2, k3, k4, k5, k6 = st.columns(6)
@@ -223,9 +474,6 @@ with tab1:
     st.subheader("재무/수익성 진단")
     left, right = st.columns([1, 1])
     with left:
-        st.write(f"- 총이익률 점수: {traffic_light(score_gm)} {score_gm if score_gm is not None else '-'}")
-        st.write(f"- 영업이익률 점수: {traffic_light(score_om)} {score_om if score_om is not None else '-'}")
-        st.write("**개선 포인트(룰 기반)**")
         tips = []
         if gross_margin is not None and gross_margin < 0.15:
             tips.append("원가 구조(재료비/외주/불량)와 납품단가 재협상, 제품 믹스 개선이 우선입니다.")
@@ -233,17 +481,19 @@ with tab1:
             tips.append("고정비·인건비 구조(간접인력, 잔업, 라인밸런싱)를 점검하고 손익분기점을 낮춰야 합니다.")
         if not tips:
             tips.append("수익성 지표는 양호합니다. 다음 단계로 제품별/고객별 손익분석을 권장합니다.")
-        st.write("\n".join([f"• {t}" for t in tips]))
+        # 한 번의 markdown으로 그려 rerun마다 전송되는 요소 수를 줄임
+        st.markdown("\n\n".join([
+            f"- 총이익률 점수: {traffic_light(score_gm)} {score_gm if score_gm is not None else '-'}",
+            f"- 영업이익률 점수: {traffic_light(score_om)} {score_om if score_om is not None else '-'}",
+            "**개선 포인트(룰 기반)**",
+            *[f"• {t}" for t in tips],
+        ]))
     with right:
         # 단가/원가가 있으면 산포도
         if col_unit_price != "(없음)" and col_unit_cost != "(없음)":
-            tmp = df[[col_unit_price, col_unit_cost]].copy()
-            tmp.columns = ["단가", "단위원가"]
-            tmp["단가"] = to_num(tmp["단가"])
-            tmp["단위원가"] = to_num(tmp["단위원가"])
-            tmp = tmp.dropna()
+            tmp = pd.DataFrame({"단가": num[col_unit_price], "단위원가": num[col_unit_cost]}).dropna()
             if not tmp.empty:
-                fig = px.scatter(tmp, x="단가", y="단위원가", title="단가 vs 단위원가 (마진 구조)")
+                fig = cached_figure("scatter", tmp, x="단가", y="단위원가", title="단가 vs 단위원가 (마진 구조)")
                 st.plotly_chart(fig, use_container_width=True)
         else:
             st.info("단가/단위원가 컬럼을 매핑하면 마진 구조 그래프를 보여줄 수 있습니다.")
@@ -252,9 +502,6 @@ with tab2:
     st.subheader("생산/품질 진단")
     left, right = st.columns([1, 1])
     with left:
-        st.write(f"- 불량률 점수: {traffic_light(score_def)} {score_def if score_def is not None else '-'}")
-        st.write(f"- 수율 점수: {traffic_light(score_yield)} {score_yield if score_yield is not None else '-'}")
-        st.write("**개선 포인트(룰 기반)**")
         tips = []
         if defect_rate is not None and defect_rate > 0.03:
             tips.append("불량 TOP 원인(공정/설비/작업자/자재) 파레토 분석 후, 표준작업/검사기준/공정능력 개선이 필요합니다.")
@@ -262,18 +509,18 @@ with tab2:
             tips.append("수율 저하는 재작업/스크랩 비용을 키웁니다. 공정조건 관리와 초도품 관리 체계를 점검하세요.")
         if not tips:
             tips.append("품질 지표는 양호합니다. 다음 단계로 공정별 불량/라인별 수율로 분해 분석을 권장합니다.")
-        st.write("\n".join([f"• {t}" for t in tips]))
+        st.markdown("\n\n".join([
+            f"- 불량률 점수: {traffic_light(score_def)} {score_def if score_def is not None else '-'}",
+            f"- 수율 점수: {traffic_light(score_yield)} {score_yield if score_yield is not None else '-'}",
+            "**개선 포인트(룰 기반)**",
+            *[f"• {t}" for t in tips],
+        ]))
     with right:
         if col_prod_qty != "(없음)" and col_defect_qty != "(없음)":
-            tmp = df[[col_prod_qty, col_defect_qty]].copy()
-            tmp.columns = ["생산수량", "불량수량"]
-            tmp["생산수량"] = to_num(tmp["생산수량"])
-            tmp["불량수량"] = to_num(tmp["불량수량"])
-            tmp = tmp.dropna()
-            if not tmp.empty:
-                tmp["불량률(행)"] = np.where(tmp["생산수량"] > 0, tmp["불량수량"] / tmp["생산수량"], np.nan)
-                tmp = tmp.dropna()
-                fig = px.histogram(tmp, x="불량률(행)", nbins=30, title="불량률 분포")
+            rate = row_ratio(num[col_defect_qty], num[col_prod_qty])
+            rate = rate[~np.isnan(rate)]
+            if rate.size:
+                fig = hist_figure(rate, "불량률(행)", "불량률 분포")
                 st.plotly_chart(fig, use_container_width=True)
         else:
             st.info("생산수량/불량수량 컬럼을 매핑하면 불량률 분포를 보여줄 수 있습니다.")
@@ -282,9 +529,6 @@ with tab3:
     st.subheader("납기/재고 진단(간이)")
     left, right = st.columns([1, 1])
     with left:
-        st.write(f"- 납기준수율 점수: {traffic_light(score_otd)} {score_otd if score_otd is not None else '-'}")
-        st.write(f"- 재고/매출 점수: {traffic_light(score_inv)} {score_inv if score_inv is not None else '-'}")
-        st.write("**개선 포인트(룰 기반)**")
         tips = []
         if on_time_rate is not None and on_time_rate < 0.90:
             tips.append("납기 지연은 신뢰/패널티로 이어집니다. 병목공정, 외주 리드타임, 자재수급(안전재고)부터 점검하세요.")
@@ -292,19 +536,18 @@ with tab3:
             tips.append("재고가 매출 대비 과다합니다. 회전율 관리(ABC, 적정재고)와 생산계획 정확도 개선이 필요합니다.")
         if not tips:
             tips.append("납기/재고 지표는 양호합니다. 다음 단계로 품목별 재고회전/납기지연 원인코드 분석을 권장합니다.")
-        st.write("\n".join([f"• {t}" for t in tips]))
+        st.markdown("\n\n".join([
+            f"- 납기준수율 점수: {traffic_light(score_otd)} {score_otd if score_otd is not None else '-'}",
+            f"- 재고/매출 점수: {traffic_light(score_inv)} {score_inv if score_inv is not None else '-'}",
+            "**개선 포인트(룰 기반)**",
+            *[f"• {t}" for t in tips],
+        ]))
     with right:
-        if col_due != "(없음)" and col_ship != "(없음)":
-            due = pd.to_datetime(df[col_due], errors="coerce")
-            ship = pd.to_datetime(df[col_ship], errors="coerce")
-            valid = due.notna() & ship.notna()
+        if due is not None:
+            valid = ~(np.isnat(due) | np.isnat(ship))
             if valid.any():
-                tmp = pd.DataFrame({
-                    "납기일": due[valid],
-                    "출고일": ship[valid],
-                    "지연일수": (ship[valid] - due[valid]).dt.days
-                })
-                fig = px.histogram(tmp, x="지연일수", nbins=30, title="납기 지연일수 분포(+)면 지연")
+                delay_days = (ship[valid] - due[valid]) // np.timedelta64(1, "D")
+                fig = hist_figure(delay_days, "지연일수", "납기 지연일수 분포(+)면 지연", integer=True)
                 st.plotly_chart(fig, use_container_width=True)
         else:
             st.info("납기일/출고일 컬럼을 매핑하면 납기 지연 분포를 보여줄 수 있습니다.")
@@ -314,47 +557,57 @@ tab4 = st.tabs(["📊 품목/라인 분석"])[0]
 with tab4:
     st.subheader("품목/라인/공정별 분해 분석")
 
-    col_item = st.selectbox("품목(선택)", ["(없음)"] + cols)
-    col_line = st.selectbox("라인(선택)", ["(없음)"] + cols)
-    col_process = st.selectbox("공정(선택)", ["(없음)"] + cols)
-    col_defect_reason = st.selectbox("불량사유(선택)", ["(없음)"] + cols)
+    keys = {name: col for name, col in [("품목", col_item), ("라인", col_line), ("불량사유", col_defect_reason)]
+            if col != "(없음)"}
+    values = {name: col for name, col in [("생산", col_prod_qty), ("양품", col_good_qty), ("불량", col_defect_qty)]
+              if col != "(없음)"}
+    agg = breakdown_sum(df, num, keys, values) if keys and values else None
 
     if col_item != "(없음)" and col_prod_qty != "(없음)" and col_defect_qty != "(없음)":
-        tmp = df[[col_item, col_prod_qty, col_defect_qty]].copy()
-        tmp.columns = ["품목", "생산", "불량"]
-        tmp["생산"] = pd.to_numeric(tmp["생산"], errors="coerce")
-        tmp["불량"] = pd.to_numeric(tmp["불량"], errors="coerce")
-        tmp = tmp.groupby("품목").sum().reset_index()
-        tmp["불량률"] = tmp["불량"] / tmp["생산"]
-
-        fig = px.bar(tmp.sort_values("불량률", ascending=False),
-                     x="품목", y="불량률",
-                     title="품목별 불량률")
+        tmp = marginal_sum(agg, "품목")
+        tmp["불량률"] = row_ratio(tmp["불량"], tmp["생산"])
+
+        fig = cached_figure("bar", tmp.sort_values("불량률", ascending=False),
+                            x="품목", y="불량률",
+                            title="품목별 불량률")
         st.plotly_chart(fig, use_container_width=True)
 
+    if col_item != "(없음)" and col_prod_qty != "(없음)" and (col_defect_qty != "(없음)" or col_good_qty != "(없음)"):
+        # 품목별 종합점수: 전체 KPI와 같은 품질 기준을 품목 단위로 한 번에(벡터) 적용
+        tmp4 = marginal_sum(agg, "품목")
+        tmp4 = tmp4[tmp4["생산"] > 0].reset_index(drop=True)
+
+        parts = []
+        if "불량" in tmp4:
+            tmp4["불량률"] = tmp4["불량"] / tmp4["생산"]
+            tmp4["불량률 점수"] = score_vec(tmp4["불량률"], good=0.01, warn=0.03, inverse=True)
+            parts.append(("불량률 점수", weights["품질(불량률)"]))
+        if "양품" in tmp4:
+            tmp4["수율"] = tmp4["양품"] / tmp4["생산"]
+            tmp4["수율 점수"] = score_vec(tmp4["수율"], good=0.98, warn=0.95)
+            parts.append(("수율 점수", weights["품질(수율)"]))
+        w = np.array([w for _, w in parts])
+        tmp4["종합점수"] = tmp4[[c for c, _ in parts]].to_numpy(dtype=np.float64) @ w / w.sum()
+
+        st.write("**품목별 종합점수(품질 기준)**")
+        st.dataframe(tmp4.sort_values("종합점수"), use_container_width=True, hide_index=True)
+
     if col_line != "(없음)" and col_good_qty != "(없음)" and col_prod_qty != "(없음)":
-        tmp2 = df[[col_line, col_good_qty, col_prod_qty]].copy()
-        tmp2.columns = ["라인", "양품", "생산"]
-        tmp2["양품"] = pd.to_numeric(tmp2["양품"], errors="coerce")
-        tmp2["생산"] = pd.to_numeric(tmp2["생산"], errors="coerce")
-        tmp2 = tmp2.groupby("라인").sum().reset_index()
-        tmp2["수율"] = tmp2["양품"] / tmp2["생산"]
-
-        fig2 = px.bar(tmp2.sort_values("수율"),
-                      x="라인", y="수율",
-                      title="라인별 수율 비교")
+        tmp2 = marginal_sum(agg, "라인")
+        tmp2["수율"] = row_ratio(tmp2["양품"], tmp2["생산"])
+
+        fig2 = cached_figure("bar", tmp2.sort_values("수율"),
+                             x="라인", y="수율",
+                             title="라인별 수율 비교")
         st.plotly_chart(fig2, use_container_width=True)
 
     if col_defect_reason != "(없음)" and col_defect_qty != "(없음)":
-        tmp3 = df[[col_defect_reason, col_defect_qty]].copy()
-        tmp3.columns = ["불량사유", "불량"]
-        tmp3["불량"] = pd.to_numeric(tmp3["불량"], errors="coerce")
-        tmp3 = tmp3.groupby("불량사유").sum().reset_index()
+        tmp3 = marginal_sum(agg, "불량사유")
         tmp3 = tmp3.sort_values("불량", ascending=False)
 
-        fig3 = px.bar(tmp3,
-                      x="불량사유", y="불량",
-                      title="불량사유 파레토")
+        fig3 = cached_figure("bar", tmp3,
+                             x="불량사유", y="불량",
+                             title="불량사유 파레토")
         st.plotly_chart(fig3, use_container_width=True)
         
 st.divider()